@@ -1,37 +1,418 @@
 import os
-import json
+import re
+import importlib.util
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import httpx
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
-from typing import Dict
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+from cachetools import TTLCache
+from redis.asyncio import Redis
+import orjson
 
 # LangChain imports
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from langchain.prompts import ChatPromptTemplate, SystemMessagePromptTemplate, HumanMessagePromptTemplate, AIMessagePromptTemplate
+from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import BaseOutputParser, JsonOutputParser, StrOutputParser
+from pydantic import ValidationError
 
-from models import UserProfile, GenerateResponseRequest
+from models import UserProfile, GenerateResponseRequest, TonedResponses, BatchedTonedResponses
+from profile_store import ProfileStore, StoredProfile
+from tone_stream import ToneStreamParser
 
 load_dotenv()
 
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # The profile store and semantic cache are set up further down
+    profile_store.start()
+    # Loading the embedding model blocks for a while, so it's done once off the event loop before serving traffic
+    await run_in_threadpool(get_semantic_cache)
+    try:
+        yield
+    finally:
+        await profile_store.close()
+
 app = FastAPI(
     title="AI Messenger Agent Backend",
     description="Generates personalized response options based on user profile and context.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=_lifespan,
 )
 
 # --- Initialize LLM (Choose one based on your .env) ---
-if os.getenv("OPENAI_API_KEY"):
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.7) # gpt-4o for best results, gpt-4o-mini for cheaper/faster
-elif os.getenv("GEMINI_API_KEY"):
-    llm = ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.7) # gemini-1.5-flash for faster/cheaper
-else:
+# LLM_BACKEND=vllm targets a self-hosted OpenAI-compatible server (vLLM, or Ollama's /v1 API) instead of a hosted one.
+# Such servers batch concurrent requests on the GPU themselves (continuous batching), so run a single worker
+# on uvloop and let the event loop keep many requests in flight:
+#   uvicorn main:app --workers 1 --loop uvloop
+# and size the server's batch slots to match, e.g. `vllm serve <model> --max-num-seqs 64` or OLLAMA_NUM_PARALLEL=8.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "").lower()
+
+# httpx only speaks HTTP/2 with the optional `h2` package (pip install "httpx[http2]") and fails without it
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+def _llm_http_client() -> httpx.AsyncClient:
+    """
+    HTTP client for OpenAI-compatible calls. The default pool is too small for bursts and makes requests
+    queue for a connection; HTTP/2, when available, multiplexes concurrent calls over one connection.
+    """
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=256, max_keepalive_connections=128),
+        timeout=httpx.Timeout(60, connect=5),
+        http2=_HTTP2_AVAILABLE,
+    )
+
+@lru_cache(maxsize=1)
+def get_llm():
+    """
+    Creates the LLM on first use rather than at import, so the app (and its tests) can start without
+    an API key. Tests can swap in a fake by patching this function and calling reset_llm().
+    """
+    if LLM_BACKEND == "vllm":
+        return ChatOpenAI(
+            base_url=os.getenv("VLLM_BASE_URL", "http://vllm:8000/v1"),
+            api_key=os.getenv("VLLM_API_KEY", "EMPTY"), # vLLM/Ollama ignore the key unless configured with one
+            model=os.getenv("VLLM_MODEL", "meta-llama/Llama-3.1-8B-Instruct"),
+            temperature=0.7,
+            max_retries=0, # retries would just re-queue behind the server's own scheduler
+            http_async_client=_llm_http_client(),
+        )
+    if os.getenv("OPENAI_API_KEY"):
+        return ChatOpenAI(model="gpt-4o", temperature=0.7, http_async_client=_llm_http_client()) # gpt-4o for best results, gpt-4o-mini for cheaper/faster
+    if os.getenv("GEMINI_API_KEY"):
+        return ChatGoogleGenerativeAI(model="gemini-pro", temperature=0.7) # gemini-1.5-flash for faster/cheaper
     raise ValueError("No valid LLM API key found in .env (OPENAI_API_KEY or GEMINI_API_KEY)")
 
-# --- In-memory store for user profiles (replace with actual DB for production) ---
-# For a real application, you would use a database (e.g., PostgreSQL, MongoDB, Redis)
-# This is a placeholder for demonstration purposes.
-user_profiles_db: Dict[str, UserProfile] = {}
+# --- LangChain Prompt Template ---
+# This is where the magic of prompt engineering happens.
+# We combine system instructions with user-specific context and the request.
+
+# Static instructions come first and per-user/per-request data last, so that every request shares
+# the longest possible identical prefix. OpenAI and Gemini cache prompt prefixes server-side
+# (OpenAI only once the prefix reaches 1024 tokens), cutting input cost and time-to-first-token.
+# The prompt is kept short on purpose, since it is sent with every request; the worked example only
+# goes out in the rare repair call (see _REPAIR_TEMPLATE).
+_SYSTEM_TEMPLATE = """
+You are a communication assistant. Write distinct response options for an incoming message that strictly match the user's communication style, personality traits, values, and boundaries from the profile below.
+
+**Rules:**
+- Always be respectful.
+- NEVER violate the user's `values_boundaries`.
+- Match formality and tone to the `conversation_context_type` AND the `desired_tones`.
+- If a tone (e.g., 'flirty') conflicts with the context (e.g., 'professional') or the boundaries, prioritize those and use a more appropriate tone instead.
+- Give 1-2 concise, distinct options per tone.
+
+**Output:** JSON only, keyed by tone: {{"options": {{"<tone>": ["<option>", ...]}}}}
+
+**User's Communication Profile:**
+{user_profile_json}
+"""
+
+_HUMAN_TEMPLATE = """
+Generate response options for the message below.
+
+**Conversation Context:** {conversation_context_type}
+
+**Desired Response Tones:** {desired_tones_list}
+
+**Incoming Message:** "{incoming_message}"
+"""
+
+# The LLM answers in JSON matching TonedResponses, so no ad-hoc text parsing is needed
+_OUTPUT_PARSER = JsonOutputParser(pydantic_object=TonedResponses)
+# Raw text chunks, for the streaming endpoint's incremental ToneStreamParser
+_TEXT_PARSER = StrOutputParser()
+
+# Use LangChain's PromptTemplate to structure your prompt (built once and shared by all requests)
+_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessagePromptTemplate.from_template(_SYSTEM_TEMPLATE),
+    HumanMessagePromptTemplate.from_template(_HUMAN_TEMPLATE),
+])
+
+_REPAIR_TEMPLATE = """
+That reply was not in the required format. Answer again with only a JSON object, for example:
+{{"options": {{"professional": ["Thanks, Tuesday works for me.", "Happy to move it, does Tuesday suit you?"], "funny": ["Only if you bring the coffee."]}}}}
+"""
+
+# Follow-up turn for a malformed reply: the original conversation, the bad answer, then a one-shot example
+_REPAIR_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessagePromptTemplate.from_template(_SYSTEM_TEMPLATE),
+    HumanMessagePromptTemplate.from_template(_HUMAN_TEMPLATE),
+    AIMessagePromptTemplate.from_template("{bad_output}"),
+    HumanMessagePromptTemplate.from_template(_REPAIR_TEMPLATE),
+])
+
+@lru_cache(maxsize=1)
+def _json_llm():
+    # OpenAI's JSON mode (also implemented by vLLM and Ollama) guarantees a syntactically valid JSON reply
+    llm = get_llm()
+    return llm.bind(response_format={"type": "json_object"}) if isinstance(llm, ChatOpenAI) else llm
+
+@lru_cache(maxsize=1)
+def _get_chain():
+    # Create the chain: Prompt -> LLM -> Output Parser
+    return _PROMPT | _json_llm() | _OUTPUT_PARSER
+
+def reset_llm() -> None:
+    """
+    Drops the cached LLM along with the JSON-mode LLM and chain built from it, so the next request
+    picks up a new backend, key, or patched get_llm.
+    """
+    get_llm.cache_clear()
+    _json_llm.cache_clear()
+    _get_chain.cache_clear()
+
+def _chain_for_user(user_id: str, prompt: ChatPromptTemplate = _PROMPT, parser: BaseOutputParser = _OUTPUT_PARSER):
+    """
+    Returns the chain to run for a user. On OpenAI, requests carry a `prompt_cache_key` so that a user's
+    calls (which share the same system prompt) are routed to the same prompt-cache slot.
+    """
+    # prompt_cache_key is an OpenAI API extension that self-hosted servers don't know about
+    if isinstance(get_llm(), ChatOpenAI) and LLM_BACKEND != "vllm":
+        return prompt | _json_llm().bind(extra_body={"prompt_cache_key": user_id}) | parser
+    if prompt is _PROMPT and parser is _OUTPUT_PARSER:
+        return _get_chain()
+    return prompt | _json_llm() | parser
+
+# --- Micro-batching ---
+# Concurrent requests from the same user (and the same version of their profile) share the same system
+# prompt, so they are coalesced into a single LLM call (up to BATCH_MAX_SIZE requests, waiting at most BATCH_MAX_LATENCY seconds for more)
+# and the reply's list of answers is handed back one per request.
+# A self-hosted server already batches concurrent calls on the GPU, so requests go straight through there.
+BATCH_MAX_SIZE = 1 if LLM_BACKEND == "vllm" else 8
+BATCH_MAX_LATENCY = 0.02
+
+_BATCH_HUMAN_TEMPLATE = """
+Answer each of the {request_count} requests below independently and in order.
+Respond with a single JSON object of the form {{"responses": [<answer to request 1>, <answer to request 2>, ...]}}, where each answer follows the output format above.
+
+{requests}
+"""
+
+_BATCH_OUTPUT_PARSER = JsonOutputParser(pydantic_object=BatchedTonedResponses)
+
+# Same system message as _PROMPT, so batched and single calls share the cached prompt prefix
+_BATCH_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessagePromptTemplate.from_template(_SYSTEM_TEMPLATE),
+    HumanMessagePromptTemplate.from_template(_BATCH_HUMAN_TEMPLATE),
+])
+
+BatchItem = Tuple[Dict[str, str], asyncio.Future]
+# Keyed by (user_id, user_profile_json): a profile update must not be answered with the previous profile's prompt
+BatchKey = Tuple[str, str]
+_batch_queues: Dict[BatchKey, asyncio.Queue] = {}
+_batch_tasks: Set[asyncio.Task] = set() # strong references, so pending batches aren't garbage collected
+
+def _spawn_batch_task(coro) -> None:
+    task = asyncio.create_task(coro)
+    _batch_tasks.add(task)
+    task.add_done_callback(_batch_tasks.discard)
+
+async def _invoke_batched(user_id: str, inputs: Dict[str, str]) -> Dict[str, List[str]]:
+    """
+    Queues the prompt inputs for the user's batcher and waits for this request's options.
+    """
+    future = asyncio.get_running_loop().create_future()
+    key = (user_id, inputs["user_profile_json"])
+    queue = _batch_queues.get(key)
+    if queue is None:
+        queue = _batch_queues[key] = asyncio.Queue()
+        _spawn_batch_task(_batcher(key, queue))
+    queue.put_nowait((inputs, future))
+    return await future
+
+async def _batcher(key: BatchKey, queue: asyncio.Queue) -> None:
+    """
+    Drains a user's queue into batches, then exits once it is empty; the next request starts a new one.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while not queue.empty():
+            batch: List[BatchItem] = [queue.get_nowait()]
+            deadline = loop.time() + BATCH_MAX_LATENCY
+            while len(batch) < BATCH_MAX_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            _spawn_batch_task(_run_batch(key[0], batch))
+    finally:
+        del _batch_queues[key]
+
+# Fallback for replies that ignore the JSON format and answer with "Tone: Option 1 | Option 2" lines
+# (providers without a JSON mode do this now and then). Compiled once, matched over the whole reply.
+_TONE_LINE = re.compile(r"(?m)^\s*([A-Za-z][A-Za-z _-]*?)\s*:\s*(.+?)\s*$")
+_TONE_SEPARATORS = re.compile(r"[\s-]+")
+
+def _parse_tone_lines(response_text: str, tones: List[str]) -> Dict[str, List[str]]:
+    """
+    Returns the options of the requested tones found in the reply, keyed like the JSON path
+    ("Semi formal:" becomes "semi_formal"); lines for anything else (e.g. "Note: ...") are ignored.
+    """
+    parsed_options = {}
+    for match in _TONE_LINE.finditer(response_text):
+        tone = _TONE_SEPARATORS.sub("_", match.group(1).lower())
+        if tone not in tones:
+            continue
+        options = [opt.strip() for opt in match.group(2).split("|") if opt.strip()]
+        if options:
+            parsed_options[tone] = options
+    return parsed_options
+
+async def _invoke_single(user_id: str, inputs: Dict[str, str]) -> Dict[str, List[str]]:
+    try:
+        result = await _chain_for_user(user_id).ainvoke(inputs)
+        parsed_options = TonedResponses.model_validate(result).options
+        if parsed_options:
+            return parsed_options
+        bad_output = orjson.dumps(result).decode()
+    except OutputParserException as e:
+        bad_output = e.llm_output or ""
+    except ValidationError:
+        bad_output = orjson.dumps(result).decode()
+    return await _recover_options(user_id, inputs, bad_output)
+
+async def _recover_options(user_id: str, inputs: Dict[str, str], bad_output: str) -> Dict[str, List[str]]:
+    """
+    Salvages a reply that isn't the expected JSON (or has no options): tone lines are parsed as such,
+    and anything else gets one more try. Raises rather than return empty options, which must not be cached.
+    """
+    tones = inputs["desired_tones_list"].split(", ")
+    parsed_options = _parse_tone_lines(bad_output, tones)
+    # A partial answer would be cached as if it were complete, so it gets the repair call too
+    if len(parsed_options) == len(tones):
+        return parsed_options
+    # Malformed reply: ask once more, this time showing a worked example
+    result = await _chain_for_user(user_id, _REPAIR_PROMPT).ainvoke({**inputs, "bad_output": bad_output})
+    parsed_options = TonedResponses.model_validate(result).options
+    if not parsed_options:
+        raise ValueError("the reply contained no response options")
+    return parsed_options
+
+async def _run_batch(user_id: str, batch: List[BatchItem]) -> None:
+    if len(batch) == 1:
+        inputs, future = batch[0]
+        try:
+            parsed_options = await _invoke_single(user_id, inputs)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(parsed_options)
+        return
+
+    requests_text = "\n\n".join(
+        f"Request {i}:\n{_HUMAN_TEMPLATE.format(**inputs)}" for i, (inputs, _) in enumerate(batch, start=1)
+    )
+    try:
+        result = await _chain_for_user(user_id, _BATCH_PROMPT, _BATCH_OUTPUT_PARSER).ainvoke({
+            "user_profile_json": batch[0][0]["user_profile_json"],
+            "request_count": len(batch),
+            "requests": requests_text,
+        })
+        responses = BatchedTonedResponses.model_validate(result).responses
+    except (OutputParserException, ValidationError):
+        responses = []
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+
+    if len(responses) != len(batch):
+        # The model didn't return one answer per request, so there's no safe way to attribute them; ask one by one
+        await asyncio.gather(*(_run_batch(user_id, [item]) for item in batch))
+        return
+    empty = []
+    for item, response in zip(batch, responses):
+        if not response.options:
+            empty.append(item) # an empty answer is retried on its own rather than handed back
+        elif not item[1].done():
+            item[1].set_result(response.options)
+    if empty:
+        await asyncio.gather(*(_run_batch(user_id, [item]) for item in empty))
+
+# --- User profile store ---
+# Profiles live in Redis, so they survive restarts and are shared by all uvicorn workers.
+# Each worker keeps an LRU of stored profiles in front of it for hot reads.
+profile_store = ProfileStore(Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+
+# --- Response cache ---
+# Exact-match cache of generated options, keyed by a hash of everything that shapes the prompt.
+_response_cache: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+
+# Single-flight registry: while a cache key is being generated, identical requests (e.g. client retries)
+# await the first request's future instead of each making their own LLM call.
+# The sync endpoint generates in a task owned by the registry, which finishes (and fills the cache) even if
+# the request that started it disconnects. A stream generates within its own request instead; if that client
+# disconnects, the flight is abandoned and the requests waiting on it start over.
+_inflight: Dict[str, asyncio.Future] = {}
+
+class _FlightAbandoned(Exception):
+    """The request leading a flight went away before finishing it."""
+
+def _begin_flight(cache_key: str) -> asyncio.Future:
+    future = _inflight[cache_key] = asyncio.get_running_loop().create_future()
+    return future
+
+def _start_flight_task(cache_key: str, coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _inflight[cache_key] = task # also the strong reference that keeps the task alive until it is done
+    task.add_done_callback(lambda done: _end_flight(cache_key, done))
+    return task
+
+def _end_flight(cache_key: str, future: asyncio.Future) -> None:
+    if _inflight.get(cache_key) is future:
+        del _inflight[cache_key]
+    if not future.done():
+        future.set_exception(_FlightAbandoned())
+    if not future.cancelled():
+        future.exception() # marks the outcome as retrieved even if nobody else was waiting for it
+
+async def _await_flight(future: asyncio.Future) -> Dict[str, List[str]]:
+    # Shielded, so a waiter that gets cancelled doesn't cancel the shared future for everyone else
+    return await asyncio.shield(future)
+
+def _response_cache_key(formatted_user_profile: str, request: GenerateResponseRequest) -> str:
+    payload = orjson.dumps({
+        "p": formatted_user_profile,
+        "m": request.incoming_message,
+        "c": request.conversation_context_type,
+        "t": request.desired_tones,
+    }, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+# --- Semantic cache ---
+# Catches paraphrased messages that miss the exact-match cache. Needs sentence-transformers and faiss;
+# set SEMANTIC_CACHE_ENABLED=false to run without them.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+
+@lru_cache(maxsize=1)
+def get_semantic_cache():
+    """
+    Loads the embedding model on first use rather than at import, since it may have to be downloaded.
+    Returns None when the semantic cache is disabled.
+    """
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    from semantic_cache import SemanticCache
+    return SemanticCache(threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")))
+
+def _semantic_bucket(profile_version: str, request: GenerateResponseRequest):
+    # The profile version (its ETag) is part of the key: options written for an earlier personality,
+    # style or set of boundaries must not be served once the profile has changed
+    return (request.user_id, profile_version, request.conversation_context_type, tuple(request.desired_tones))
 
 # --- API Endpoints ---
 
@@ -41,100 +422,200 @@ async def set_user_profile(profile: UserProfile):
     Sets or updates the detailed communication profile for a user.
     This profile is used by the AI agent to personalize responses.
     """
-    user_profiles_db[profile.id] = profile
+    await profile_store.set(profile)
     return {"message": "User profile updated successfully", "user_id": profile.id}
 
 @app.get("/user_profile/{user_id}", response_model=UserProfile, summary="Get a user's communication profile")
-async def get_user_profile(user_id: str):
+async def get_user_profile(user_id: str, if_none_match: Optional[str] = Header(None)):
     """
     Retrieves the communication profile for a specific user.
+    Responses carry an ETag; a request whose If-None-Match matches it gets an empty 304 Not Modified.
     """
-    profile = user_profiles_db.get(user_id)
-    if not profile:
+    stored = await profile_store.get(user_id)
+    if not stored:
         raise HTTPException(status_code=404, detail="User profile not found. Please set it first.")
-    return profile
+    headers = {"ETag": stored.etag}
+    if _etag_matches(if_none_match, stored.etag):
+        return Response(status_code=304, headers=headers)
+    # The stored JSON is already the serialized profile, so it is sent as-is
+    return Response(content=stored.blob, media_type="application/json", headers=headers)
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 prescribes for If-None-Match
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
 
-@app.post("/generate_responses", summary="Generate personalized response options")
+@app.post("/generate_responses", summary="Stream personalized response options")
 async def generate_responses_endpoint(request: GenerateResponseRequest):
     """
-    Generates a list of personalized response options for an incoming message
-    based on the user's profile, conversation context, and desired tones.
+    Streams personalized response options for an incoming message as Server-Sent Events.
+    Each event carries one tone, `{"tone": ..., "options": [...]}`, sent as soon as that tone
+    is complete, so the first options arrive long before the whole reply has been generated.
+    The stream ends with a `{"done": true}` event, or an `error` event if generation failed.
     """
-    user_profile = user_profiles_db.get(request.user_id)
-    if not user_profile:
+    stored = await profile_store.get(request.user_id)
+    if not stored:
         raise HTTPException(status_code=404, detail="User profile not found. Please set it first.")
 
-    # --- LangChain Prompt Template ---
-    # This is where the magic of prompt engineering happens.
-    # We combine system instructions with user-specific context and the request.
+    return StreamingResponse(
+        _stream_options(stored, request),
+        media_type="text/event-stream",
+    )
 
-    system_template = """
-    You are a highly skilled AI communication assistant. Your task is to generate several distinct response options for an incoming message.
-    Crucially, all generated responses MUST strictly adhere to the provided user's communication style, personality traits, values, and boundaries.
+# With a response_model, FastAPI serializes the result through pydantic's JSON encoder rather than the stdlib one
+@app.post("/generate_responses_sync", response_model=TonedResponses, summary="Generate personalized response options")
+async def generate_responses_sync_endpoint(request: GenerateResponseRequest):
+    """
+    Generates a list of personalized response options for an incoming message
+    based on the user's profile, conversation context, and desired tones.
+    """
+    stored = await profile_store.get(request.user_id)
+    if not stored:
+        raise HTTPException(status_code=404, detail="User profile not found. Please set it first.")
 
-    **User's Communication Profile:**
-    {user_profile_json}
+    cache_key = _response_cache_key(stored.prompt_json, request)
+    while True:
+        parsed_options = _response_cache.get(cache_key)
+        if parsed_options is not None:
+            return {"options": parsed_options}
 
-    **Strict Rules & Boundaries:**
-    - Always be respectful.
-    - NEVER generate content that violates the user's specified `values_boundaries`.
-    - Adapt the formality and tone based on the `conversation_context_type` AND the `desired_tones`.
-    - If a requested tone (e.g., 'flirty') conflicts with the `conversation_context_type` (e.g., 'professional') or user's `values_boundaries`, prioritize the boundaries and context, and generate a more appropriate general tone instead, or state why it's not possible.
-    - Provide concise and distinct options for each requested tone.
+        flight = _inflight.get(cache_key)
+        if flight is None:
+            flight = _start_flight_task(cache_key, _produce_options(stored, request, cache_key))
+        try:
+            return {"options": await _await_flight(flight)}
+        except _FlightAbandoned:
+            continue # the stream leading that flight disconnected, so start over
 
-    **Output Format:**
-    For each desired tone, provide 1-2 options clearly labeled. Example:
-    Professional: [Option 1] | [Option 2]
-    Funny: [Option 1] | [Option 2]
-    ...
+async def _produce_options(stored: StoredProfile, request: GenerateResponseRequest, cache_key: str) -> Dict[str, List[str]]:
     """
+    Looks the request up in the semantic cache, or else generates its options, and caches the result.
+    """
+    try:
+        parsed_options, vec = await _semantic_lookup(stored.etag, request)
+        if parsed_options is None:
+            parsed_options = await _generate_options(stored.prompt_json, request)
+            _semantic_store(stored.etag, request, vec, parsed_options)
+    except Exception as e:
+        raise _generation_error(e)
+    _response_cache[cache_key] = parsed_options
+    return parsed_options
 
-    human_template = """
-    **Incoming Message:** "{incoming_message}"
+async def _semantic_lookup(profile_version: str, request: GenerateResponseRequest):
+    """
+    Returns options cached for a semantically similar message (or None), along with the message
+    embedding so that a miss can be stored without embedding it again.
+    """
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is None:
+        return None, None
+    vec = await run_in_threadpool(semantic_cache.embed, request.incoming_message)
+    return semantic_cache.lookup(_semantic_bucket(profile_version, request), vec), vec
 
-    **Conversation Context:** {conversation_context_type}
+def _semantic_store(profile_version: str, request: GenerateResponseRequest, vec, parsed_options: Dict[str, List[str]]) -> None:
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None:
+        semantic_cache.add(_semantic_bucket(profile_version, request), vec, parsed_options)
 
-    **Desired Response Tones:** {desired_tones_list}
+def _prompt_inputs(formatted_user_profile: str, request: GenerateResponseRequest) -> Dict[str, str]:
+    # Prepare data for the prompt
+    return {
+        "user_profile_json": formatted_user_profile,
+        "incoming_message": request.incoming_message,
+        "conversation_context_type": request.conversation_context_type,
+        "desired_tones_list": ", ".join(request.desired_tones),
+    }
 
-    Generate response options now:
+async def _generate_options(formatted_user_profile: str, request: GenerateResponseRequest) -> Dict[str, List[str]]:
     """
+    Runs the LLM for a single request (possibly batched with other requests from the same user)
+    and returns its options per tone.
+    """
+    return await _invoke_batched(request.user_id, _prompt_inputs(formatted_user_profile, request))
 
-    # Use LangChain's PromptTemplate to structure your prompt
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessagePromptTemplate.from_template(system_template),
-        HumanMessagePromptTemplate.from_template(human_template),
-    ])
+def _generation_error(e: Exception) -> HTTPException:
+    return e if isinstance(e, HTTPException) else HTTPException(status_code=500, detail=f"Error generating responses: {e}")
 
-    # Prepare data for the prompt
-    formatted_user_profile = json.dumps(user_profile.model_dump(), indent=2) # .model_dump() for Pydantic v2
-    desired_tones_str = ", ".join(request.desired_tones)
+def _sse_event(payload: dict, event: Optional[str] = None) -> str:
+    data = f"data: {orjson.dumps(payload).decode()}\n\n"
+    return f"event: {event}\n{data}" if event else data
 
-    # Create the chain: Prompt -> LLM -> Output Parser
-    chain = prompt | llm | StrOutputParser()
+_SSE_DONE = _sse_event({"done": True})
 
-    try:
-        response_text = await chain.ainvoke({
-            "user_profile_json": formatted_user_profile,
-            "incoming_message": request.incoming_message,
-            "conversation_context_type": request.conversation_context_type,
-            "desired_tones_list": desired_tones_str
-        })
+def _replay_options(parsed_options: Dict[str, List[str]]) -> Iterator[str]:
+    for tone, options in parsed_options.items():
+        yield _sse_event({"tone": tone, "options": options})
+    yield _SSE_DONE
 
-        # Basic parsing of the generated text into a list of options
-        # This can be made more robust with Pydantic output parsers or regex
-        lines = response_text.strip().split('\n')
-        parsed_options = {}
-        for line in lines:
-            if ':' in line:
-                tone, options_str = line.split(':', 1)
-                options = [opt.strip() for opt in options_str.split('|') if opt.strip()]
-                if options:
-                    parsed_options[tone.strip()] = options
+async def _stream_options(stored: StoredProfile, request: GenerateResponseRequest) -> AsyncIterator[str]:
+    """
+    Yields one SSE event per tone. Cached options are replayed straight away; otherwise the LLM reply is
+    parsed incrementally as it streams in and each tone is emitted as soon as its options are complete.
+    """
+    formatted_user_profile = stored.prompt_json
+    cache_key = _response_cache_key(formatted_user_profile, request)
+    while True:
+        parsed_options = _response_cache.get(cache_key)
+        flight = _inflight.get(cache_key)
+        if parsed_options is not None or flight is None:
+            break
+        try:
+            parsed_options = await _await_flight(flight)
+            break
+        except _FlightAbandoned:
+            continue # the stream leading that flight disconnected, so start over
+        except Exception as e:
+            yield _sse_event({"detail": _generation_error(e).detail}, event="error")
+            return
+    if parsed_options is not None:
+        for event in _replay_options(parsed_options):
+            yield event
+        return
 
-        return {"options": parsed_options}
+    future = _begin_flight(cache_key)
+    try:
+        try:
+            parsed_options, vec = await _semantic_lookup(stored.etag, request)
+            if parsed_options is not None:
+                for tone, options in parsed_options.items():
+                    yield _sse_event({"tone": tone, "options": options})
+            else:
+                # Streaming bypasses micro-batching: a batched reply only becomes usable once it is complete
+                parser = ToneStreamParser()
+                parsed_options = {}
+                raw_reply: List[str] = [] # only kept until the first tone parses
+                inputs = _prompt_inputs(formatted_user_profile, request)
+                chain = _chain_for_user(request.user_id, parser=_TEXT_PARSER)
+                async for chunk in chain.astream(inputs):
+                    if not parsed_options:
+                        raw_reply.append(chunk)
+                    for tone, options in parser.feed(chunk):
+                        parsed_options[tone] = options
+                        yield _sse_event({"tone": tone, "options": options})
+                if not parsed_options:
+                    # Not the expected JSON (Gemini has no JSON mode to enforce it), so fall back like
+                    # the sync endpoint does and send the recovered options all at once
+                    parsed_options = await _recover_options(request.user_id, inputs, "".join(raw_reply))
+                    for tone, options in parsed_options.items():
+                        yield _sse_event({"tone": tone, "options": options})
+                _semantic_store(stored.etag, request, vec, parsed_options)
+        except Exception as e:
+            error = _generation_error(e)
+            future.set_exception(error)
+            yield _sse_event({"detail": error.detail}, event="error")
+            return
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating responses: {e}")
+        # Stored before the final event, since the client may disconnect as soon as it has seen it
+        _response_cache[cache_key] = parsed_options
+        future.set_result(parsed_options)
+        yield _SSE_DONE
+    finally:
+        _end_flight(cache_key, future)
 
 # --- Run the FastAPI App ---
-# To run: uvicorn main:app --reload
\ No newline at end of file
+# To run: uvicorn main:app --reload
+# In production: uvicorn main:app --loop uvloop --http httptools --workers $(nproc)
+# With LLM_BACKEND=vllm: uvicorn main:app --workers 1 --loop uvloop
\ No newline at end of file
@@ -1,19 +1,28 @@
-from pydantic import BaseModel, Field
-from typing import List, Literal, Optional
+from pydantic import BaseModel, Field, conlist, field_validator
+from typing import Dict, List, Literal, Optional
+
+# Shared vocabularies, so each set of allowed values is spelled out once. Plain Literal aliases validate
+# exactly like the inline Literal[...] they replace and keep the OpenAPI schema free of extra components.
+Level = Literal["low", "medium", "high", "very_high"]
+Amount = Literal["none", "low", "medium", "high"]
+Formality = Literal["formal", "semi_formal", "casual", "chatty"]
+Conciseness = Literal["concise", "verbose"]
+ConversationContext = Literal["professional", "casual", "personal", "dating", "group_chat", "other"]
+Tone = Literal["professional", "formal", "semi_formal", "chatty", "flirty", "funny", "empathetic", "direct", "diplomatic", "concise"]
 
 class Personality(BaseModel):
-    openness: Literal["low", "medium", "high", "very_high"] = "medium"
-    conscientiousness: Literal["low", "medium", "high", "very_high"] = "medium"
-    extraversion: Literal["low", "medium", "high", "very_high"] = "medium"
-    agreeableness: Literal["low", "medium", "high", "very_high"] = "medium"
-    neuroticism: Literal["low", "medium", "high", "very_high"] = "medium"
+    openness: Level = "medium"
+    conscientiousness: Level = "medium"
+    extraversion: Level = "medium"
+    agreeableness: Level = "medium"
+    neuroticism: Level = "medium"
 
 class CommunicationStyle(BaseModel):
-    formality_preference: Literal["formal", "semi_formal", "casual", "chatty"] = "casual"
-    conciseness_preference: Literal["concise", "verbose"] = "concise"
-    humor_level: Literal["none", "low", "medium", "high"] = "medium"
-    empathy_level: Literal["low", "medium", "high", "very_high"] = "medium"
-    flirty_level: Literal["none", "low", "medium", "high"] = "none" # Explicitly control flirty
+    formality_preference: Formality = "casual"
+    conciseness_preference: Conciseness = "concise"
+    humor_level: Amount = "medium"
+    empathy_level: Level = "medium"
+    flirty_level: Amount = "none" # Explicitly control flirty
 
 class UserProfile(BaseModel):
     id: str = Field(..., description="Unique ID for the user")
@@ -24,8 +33,32 @@ class UserProfile(BaseModel):
 class GenerateResponseRequest(BaseModel):
     user_id: str = Field(..., description="The ID of the user requesting responses")
     incoming_message: str = Field(..., description="The message received from the other person")
-    conversation_context_type: Literal["professional", "casual", "personal", "dating", "group_chat", "other"] = "casual"
-    desired_tones: List[Literal["professional", "formal", "semi_formal", "chatty", "flirty", "funny", "empathetic", "direct", "diplomatic", "concise"]] = Field(..., description="List of desired tones for responses")
+    conversation_context_type: ConversationContext = "casual"
+    # Each tone adds 1-2 options to the output, so the list is capped to bound output tokens (and latency)
+    desired_tones: conlist(Tone, min_length=1, max_length=6) = Field(..., description="List of desired tones for responses")
     # For future:
     # sender_info: Optional[str] = None # e.g., "My boss", "My best friend"
-    # conversation_history: Optional[List[dict]] = None # [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
\ No newline at end of file
+    # conversation_history: Optional[List[dict]] = None # [{"role": "user", "content": "..."}, {"role": "assistant", "content": "..."}]
+
+    @field_validator("desired_tones", mode="before")
+    @classmethod
+    def _dedupe_tones(cls, tones):
+        # Before validation, so that the length limit counts distinct tones
+        if isinstance(tones, list):
+            try:
+                return list(dict.fromkeys(tones))
+            except TypeError: # unhashable items, which validation rejects anyway
+                pass
+        return tones
+
+    @field_validator("desired_tones")
+    @classmethod
+    def _sort_tones(cls, tones: List[str]) -> List[str]:
+        # A stable order also makes identical requests hit the same cache entries
+        return sorted(tones)
+
+class TonedResponses(BaseModel):
+    options: Dict[str, List[str]] = Field(..., description="Response options keyed by tone name, 1-2 options per tone")
+
+class BatchedTonedResponses(BaseModel):
+    responses: List[TonedResponses] = Field(..., description="One answer per request, in the order the requests were given")
@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import logging
+import uuid
+from typing import NamedTuple, Optional
+
+import orjson
+from cachetools import TTLCache
+from redis.asyncio import Redis
+
+from models import UserProfile
+
+INVALIDATION_CHANNEL = "up_invalidate"
+
+# Delay before resubscribing after the invalidation listener loses Redis, doubled up to the maximum
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+
+logger = logging.getLogger(__name__)
+
+def serialize_profile(profile: UserProfile) -> bytes:
+    # Stored, served and embedded in the prompt as-is. Compact on purpose: indentation only adds
+    # input tokens, the model reads the JSON just as well without it
+    return orjson.dumps(profile.model_dump()) # .model_dump() for Pydantic v2
+
+class StoredProfile(NamedTuple):
+    prompt_json: str # `blob` decoded once per load for the prompt, instead of on every generation
+    blob: bytes # Serialized profile as stored in Redis, also served as-is by the API
+    etag: str # HTTP entity tag of `blob`
+
+class ProfileStore:
+    """
+    User profiles persisted in Redis (one key per user) and fronted by an in-process LRU of stored profiles.
+    Every write is announced on INVALIDATION_CHANNEL so that other workers drop their stale copy.
+    Profiles are only cached while that subscription is live, and for at most `ttl` seconds, so a missed
+    invalidation can't keep a stale profile around for long.
+
+    Profiles are validated once, when they are written through `set`; reads hand out the stored JSON
+    without parsing it. Anything that changes a profile must therefore go through `set`, never write to Redis directly.
+    """
+
+    def __init__(self, redis: Redis, lru_size: int = 10_000, ttl: float = 300):
+        self.redis = redis
+        self._lru: TTLCache = TTLCache(maxsize=lru_size, ttl=ttl)
+        # Bumped on every invalidation; a Redis read that straddles one must not be cached
+        self._generation = 0
+        self._subscribed = False
+        # Identifies this worker's own invalidation messages, which it can ignore
+        self._instance_id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"up:{user_id}"
+
+    def _remember(self, user_id: str, blob: bytes, generation: int) -> StoredProfile:
+        etag = f'"{hashlib.sha1(blob).hexdigest()}"'
+        stored = StoredProfile(blob.decode(), blob, etag)
+        # Without a live subscription, or after an invalidation arrived mid-read, the blob may already be stale
+        if self._subscribed and generation == self._generation:
+            self._lru[user_id] = stored
+        return stored
+
+    def _invalidate(self, user_id: Optional[str] = None) -> None:
+        self._generation += 1
+        if user_id is None:
+            self._lru.clear()
+        else:
+            self._lru.pop(user_id, None)
+
+    async def get(self, user_id: str) -> Optional[StoredProfile]:
+        stored = self._lru.get(user_id)
+        if stored is not None:
+            return stored
+        generation = self._generation
+        raw = await self.redis.get(self._key(user_id))
+        if raw is None:
+            return None
+        return self._remember(user_id, raw, generation)
+
+    async def set(self, profile: UserProfile) -> StoredProfile:
+        blob = serialize_profile(profile)
+        generation = self._generation
+        await self.redis.set(self._key(profile.id), blob)
+        stored = self._remember(profile.id, blob, generation)
+        await self.redis.publish(INVALIDATION_CHANNEL, f"{self._instance_id}:{profile.id}")
+        return stored
+
+    def start(self) -> None:
+        self._listener = asyncio.create_task(self._listen_for_invalidations())
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        await self.redis.aclose()
+
+    async def _listen_for_invalidations(self) -> None:
+        """
+        Applies other workers' invalidations, resubscribing with backoff whenever the connection is lost.
+        """
+        delay = RECONNECT_DELAY
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Invalidations sent while unsubscribed were missed, so nothing cached before now can be trusted
+                self._invalidate()
+                self._subscribed = True
+                delay = RECONNECT_DELAY
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    origin, _, user_id = message["data"].decode().partition(":")
+                    if origin != self._instance_id:
+                        self._invalidate(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Profile invalidation listener lost Redis (%s), retrying in %.1fs", e, delay)
+            finally:
+                self._subscribed = False
+                self._invalidate()
+                await pubsub.aclose()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
@@ -0,0 +1,84 @@
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from cachetools import TTLCache
+from sentence_transformers import SentenceTransformer
+
+# (user_id, profile version, conversation_context_type, sorted desired tones)
+BucketKey = Tuple[str, str, str, Tuple[str, ...]]
+
+# HNSW graph parameters: neighbours per node, and candidates explored per search
+HNSW_M = 32
+HNSW_EF_SEARCH = 16
+
+class _Bucket:
+    """
+    One HNSW index and, parallel to it by FAISS row id, the options of each embedding in it.
+    """
+
+    def __init__(self, dim: int):
+        self.index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efSearch = HNSW_EF_SEARCH
+        self.options: List[Dict[str, List[str]]] = []
+
+class SemanticCache:
+    """
+    Caches generated options by the meaning of the incoming message, so that paraphrased
+    messages ("can we reschedule?" / "could we move the meeting?") reuse an earlier response.
+    Entries are bucketed per user, profile version, context and tone set, so a lookup only ever searches
+    the small index of its own bucket; each bucket is an HNSW graph, keeping searches sub-millisecond as it grows.
+
+    HNSW indexes can't delete entries, so a full bucket is rebuilt from its newest half, and buckets
+    that go unused for `bucket_ttl` seconds (e.g. those of a profile that has since changed) are dropped.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "all-MiniLM-L6-v2",
+        threshold: float = 0.92,
+        max_entries_per_bucket: int = 256,
+        max_buckets: int = 10_000,
+        bucket_ttl: float = 3600,
+    ):
+        self.embedder = SentenceTransformer(model_name)
+        self.threshold = threshold
+        self.max_entries_per_bucket = max_entries_per_bucket
+        self._buckets: TTLCache = TTLCache(maxsize=max_buckets, ttl=bucket_ttl)
+
+    def embed(self, message: str) -> np.ndarray:
+        """
+        Returns the normalized embedding of a message, so inner product equals cosine similarity.
+        This is CPU-bound; call it from a worker thread.
+        """
+        return self.embedder.encode([message], normalize_embeddings=True)
+
+    def lookup(self, bucket_key: BucketKey, vec: np.ndarray) -> Optional[Dict[str, List[str]]]:
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            return None
+        self._buckets[bucket_key] = bucket # re-inserting renews the bucket's TTL, so only idle buckets expire
+        scores, ids = bucket.index.search(vec, 1)
+        if scores[0][0] < self.threshold:
+            return None
+        return bucket.options[ids[0][0]]
+
+    def add(self, bucket_key: BucketKey, vec: np.ndarray, parsed_options: Dict[str, List[str]]) -> None:
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = _Bucket(vec.shape[1])
+        elif len(bucket.options) >= self.max_entries_per_bucket:
+            bucket = self._rebuild(bucket, keep=self.max_entries_per_bucket // 2)
+        self._buckets[bucket_key] = bucket
+        bucket.index.add(vec)
+        bucket.options.append(parsed_options)
+
+    @staticmethod
+    def _rebuild(bucket: _Bucket, keep: int) -> _Bucket:
+        rebuilt = _Bucket(bucket.index.d)
+        if keep:
+            # The flat storage under the graph still holds every embedding, in insertion order
+            start = bucket.index.ntotal - keep
+            rebuilt.index.add(bucket.index.reconstruct_n(start, keep))
+            rebuilt.options = bucket.options[start:]
+        return rebuilt
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# The semantic cache downloads an embedding model; the tests run without it
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models import CommunicationStyle, GenerateResponseRequest, Personality, UserProfile  # noqa: E402
+from profile_store import INVALIDATION_CHANNEL, StoredProfile, serialize_profile  # noqa: E402
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def subscribe(self, channel):
+        assert channel == INVALIDATION_CHANNEL
+        if self.redis.down:
+            raise ConnectionError("redis is down")
+        self.redis.subscriptions += 1
+
+    async def listen(self):
+        while True:
+            message = await self.redis.messages.get()
+            if isinstance(message, Exception):
+                raise message
+            yield {"type": "message", "data": message.encode()}
+
+    async def aclose(self):
+        pass
+
+
+class FakeRedis:
+    """The slice of redis.asyncio.Redis that ProfileStore uses, kept in memory."""
+
+    def __init__(self):
+        self.data = {}
+        self.messages = asyncio.Queue()
+        self.down = False
+        self.subscriptions = 0
+        self.read_gate = None # when set, get() waits on it, to interleave an invalidation with a read
+
+    async def get(self, key):
+        value = self.data.get(key)
+        if self.read_gate is not None:
+            await self.read_gate.wait()
+        return value
+
+    async def set(self, key, value):
+        self.data[key] = value
+
+    async def publish(self, channel, message):
+        pass
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def fake_redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def make_profile():
+    def make(user_id: str = "u1", boundaries=()) -> UserProfile:
+        return UserProfile(
+            id=user_id,
+            personality=Personality(),
+            communication_style=CommunicationStyle(),
+            values_boundaries=list(boundaries),
+        )
+    return make
+
+
+@pytest.fixture
+def stored(make_profile) -> StoredProfile:
+    blob = serialize_profile(make_profile())
+    return StoredProfile(blob.decode(), blob, '"v1"')
+
+
+@pytest.fixture
+def generate_request() -> GenerateResponseRequest:
+    return GenerateResponseRequest(user_id="u1", incoming_message="lunch?", desired_tones=["funny", "direct"])
+
+
+@pytest.fixture
+def settle():
+    """Lets every task that is ready run a few steps, e.g. up to the point where it blocks."""
+    async def settle():
+        for _ in range(5):
+            await asyncio.sleep(0)
+    return settle
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+class FakeChain:
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    async def ainvoke(self, inputs):
+        self.calls.append(inputs)
+        await asyncio.sleep(0)
+        return self.reply(inputs)
+
+
+def _inputs(message: str, profile: str = '{"id":"u1"}') -> dict:
+    return {
+        "user_profile_json": profile,
+        "incoming_message": message,
+        "conversation_context_type": "casual",
+        "desired_tones_list": "funny",
+    }
+
+
+def _single_reply(inputs):
+    return {"options": {"funny": [f"re: {inputs['incoming_message']}"]}}
+
+
+@pytest.fixture
+def chains(monkeypatch):
+    """Replaces the LLM chains: `single` answers one request, `batch` answers a batched call."""
+    fakes = {"single": FakeChain(_single_reply), "batch": FakeChain(lambda inputs: {"responses": []})}
+
+    def chain_for_user(user_id, prompt=main._PROMPT, parser=main._OUTPUT_PARSER):
+        return fakes["batch"] if prompt is main._BATCH_PROMPT else fakes["single"]
+
+    monkeypatch.setattr(main, "_chain_for_user", chain_for_user)
+    return fakes
+
+
+async def _gather_batched(*inputs):
+    return await asyncio.gather(*(main._invoke_batched("u1", i) for i in inputs), return_exceptions=True)
+
+
+def test_single_request_is_not_batched(chains):
+    results = asyncio.run(_gather_batched(_inputs("hi")))
+
+    assert results == [{"funny": ["re: hi"]}]
+    assert len(chains["single"].calls) == 1
+    assert chains["batch"].calls == []
+    assert main._batch_queues == {}
+
+
+def test_concurrent_requests_share_one_call(chains):
+    chains["batch"].reply = lambda inputs: {"responses": [
+        {"options": {"funny": ["first"]}},
+        {"options": {"funny": ["second"]}},
+    ]}
+
+    results = asyncio.run(_gather_batched(_inputs("one"), _inputs("two")))
+
+    assert results == [{"funny": ["first"]}, {"funny": ["second"]}]
+    assert len(chains["batch"].calls) == 1
+    assert chains["batch"].calls[0]["request_count"] == 2
+    assert chains["single"].calls == []
+
+
+def test_profile_versions_are_batched_separately(chains):
+    results = asyncio.run(_gather_batched(_inputs("one", '{"v":1}'), _inputs("two", '{"v":2}')))
+
+    assert results == [{"funny": ["re: one"]}, {"funny": ["re: two"]}]
+    assert chains["batch"].calls == []
+    assert sorted(c["user_profile_json"] for c in chains["single"].calls) == ['{"v":1}', '{"v":2}']
+
+
+def test_wrong_answer_count_falls_back_to_single_calls(chains):
+    chains["batch"].reply = lambda inputs: {"responses": [{"options": {"funny": ["only one"]}}]}
+
+    results = asyncio.run(_gather_batched(_inputs("one"), _inputs("two"), _inputs("three")))
+
+    assert results == [{"funny": ["re: one"]}, {"funny": ["re: two"]}, {"funny": ["re: three"]}]
+    assert len(chains["batch"].calls) == 1
+    assert len(chains["single"].calls) == 3
+
+
+def test_malformed_batch_reply_falls_back_to_single_calls(chains):
+    chains["batch"].reply = lambda inputs: {"answers": "nope"}
+
+    results = asyncio.run(_gather_batched(_inputs("one"), _inputs("two")))
+
+    assert results == [{"funny": ["re: one"]}, {"funny": ["re: two"]}]
+
+
+def test_batch_errors_reach_every_request(chains):
+    def fail(inputs):
+        raise RuntimeError("provider down")
+    chains["batch"].reply = fail
+
+    results = asyncio.run(_gather_batched(_inputs("one"), _inputs("two")))
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert chains["single"].calls == []
+
+
+def test_empty_options_are_repaired(chains, monkeypatch):
+    chains["single"].reply = lambda inputs: {"options": {}}
+    repair = FakeChain(lambda inputs: {"options": {"funny": ["repaired"]}})
+
+    def chain_for_user(user_id, prompt=main._PROMPT, parser=main._OUTPUT_PARSER):
+        return repair if prompt is main._REPAIR_PROMPT else chains["single"]
+    monkeypatch.setattr(main, "_chain_for_user", chain_for_user)
+
+    assert asyncio.run(_gather_batched(_inputs("hi"))) == [{"funny": ["repaired"]}]
+    assert repair.calls[0]["bad_output"] == '{"options":{}}'
+
+
+def test_empty_options_after_repair_are_an_error(chains):
+    chains["single"].reply = lambda inputs: {"options": {}}
+
+    results = asyncio.run(_gather_batched(_inputs("hi")))
+
+    assert isinstance(results[0], ValueError)
+
+
+def test_empty_batched_answer_is_retried_on_its_own(chains):
+    chains["batch"].reply = lambda inputs: {"responses": [
+        {"options": {"funny": ["first"]}},
+        {"options": {}},
+    ]}
+
+    results = asyncio.run(_gather_batched(_inputs("one"), _inputs("two")))
+
+    assert results == [{"funny": ["first"]}, {"funny": ["re: two"]}]
+    assert len(chains["single"].calls) == 1
@@ -0,0 +1,27 @@
+import pytest
+from pydantic import ValidationError
+
+from models import GenerateResponseRequest
+
+
+def _request(tones):
+    return GenerateResponseRequest(user_id="u1", incoming_message="hi", desired_tones=tones)
+
+
+def test_tones_are_deduplicated_and_sorted():
+    assert _request(["funny", "direct", "funny"]).desired_tones == ["direct", "funny"]
+
+
+def test_limit_counts_distinct_tones():
+    assert _request(["funny"] * 7).desired_tones == ["funny"]
+
+
+def test_too_many_distinct_tones():
+    with pytest.raises(ValidationError):
+        _request(["professional", "formal", "semi_formal", "chatty", "flirty", "funny", "direct"])
+
+
+@pytest.mark.parametrize("tones", [[], ["sarcastic"], [{"tone": "funny"}], "funny"])
+def test_invalid_tones(tones):
+    with pytest.raises(ValidationError):
+        _request(tones)
@@ -0,0 +1,62 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from profile_store import ProfileStore
+
+
+@pytest.fixture
+def client(monkeypatch, fake_redis):
+    monkeypatch.setattr(main, "profile_store", ProfileStore(fake_redis))
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def etag(client, make_profile):
+    assert client.post("/user_profile", json=make_profile().model_dump()).status_code == 200
+    return client.get("/user_profile/u1").headers["ETag"]
+
+
+def test_get_returns_the_profile_with_an_etag(client, make_profile):
+    client.post("/user_profile", json=make_profile(boundaries=["no swearing"]).model_dump())
+
+    response = client.get("/user_profile/u1")
+
+    assert response.status_code == 200
+    assert response.json() == make_profile(boundaries=["no swearing"]).model_dump()
+    assert response.headers["ETag"].startswith('"') and response.headers["ETag"].endswith('"')
+
+
+def test_unknown_profile_is_404(client):
+    assert client.get("/user_profile/nobody").status_code == 404
+
+
+@pytest.mark.parametrize("if_none_match", [
+    lambda etag: etag,
+    lambda etag: f"W/{etag}",
+    lambda etag: "*",
+    lambda etag: f'"other", {etag}',
+])
+def test_matching_if_none_match_is_304(client, etag, if_none_match):
+    response = client.get("/user_profile/u1", headers={"If-None-Match": if_none_match(etag)})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+
+def test_mismatched_if_none_match_is_200(client, etag):
+    response = client.get("/user_profile/u1", headers={"If-None-Match": '"other"'})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] == etag
+
+
+def test_update_changes_the_etag(client, etag, make_profile):
+    client.post("/user_profile", json=make_profile(boundaries=["changed"]).model_dump())
+
+    response = client.get("/user_profile/u1", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["values_boundaries"] == ["changed"]
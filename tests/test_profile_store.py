@@ -0,0 +1,81 @@
+import asyncio
+
+import orjson
+
+import profile_store
+from profile_store import ProfileStore, serialize_profile
+
+
+def _write(redis, profile) -> None:
+    """Writes a profile the way another worker would."""
+    redis.data[f"up:{profile.id}"] = serialize_profile(profile)
+
+
+def test_profiles_are_only_cached_while_subscribed(fake_redis, make_profile, settle):
+    async def scenario():
+        redis = fake_redis
+        store = ProfileStore(redis)
+        _write(redis, make_profile())
+        await store.get("u1")
+        assert "u1" not in store._lru
+
+        store.start()
+        await settle()
+        await store.get("u1")
+        assert "u1" in store._lru
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_invalidation_during_read_is_not_overwritten(fake_redis, make_profile, settle):
+    async def scenario():
+        redis = fake_redis
+        store = ProfileStore(redis)
+        store.start()
+        await settle()
+        _write(redis, make_profile(boundaries=["old"]))
+
+        redis.read_gate = asyncio.Event()
+        read = asyncio.create_task(store.get("u1"))
+        await settle()
+        # Another worker updates the profile while the read is in flight
+        _write(redis, make_profile(boundaries=["new"]))
+        redis.messages.put_nowait("other-worker:u1")
+        await settle()
+        redis.read_gate.set()
+        await read
+
+        redis.read_gate = None
+        assert orjson.loads((await store.get("u1")).blob)["values_boundaries"] == ["new"]
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_listener_reconnects_and_drops_cached_profiles(monkeypatch, fake_redis, make_profile, settle):
+    monkeypatch.setattr(profile_store, "RECONNECT_DELAY", 0)
+
+    async def scenario():
+        redis = fake_redis
+        redis.down = True
+        store = ProfileStore(redis)
+        store.start()
+        await settle()
+        assert redis.subscriptions == 0
+
+        redis.down = False
+        await settle()
+        assert redis.subscriptions == 1
+        _write(redis, make_profile())
+        await store.get("u1")
+        assert "u1" in store._lru
+
+        redis.messages.put_nowait(ConnectionError("connection lost"))
+        await settle()
+        assert "u1" not in store._lru
+        assert redis.subscriptions == 2
+        assert not store._listener.done()
+        await store.close()
+
+    asyncio.run(scenario())
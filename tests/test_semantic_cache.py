@@ -0,0 +1,90 @@
+import importlib
+import sys
+import types
+
+import numpy as np
+import pytest
+from cachetools import TTLCache
+
+pytest.importorskip("faiss")
+
+DIM = 8
+
+
+class StubEmbedder:
+    """Embeds "e<n>" as the n-th unit vector, and "e<n>~" as a slightly rotated copy of it."""
+
+    def __init__(self, model_name):
+        pass
+
+    def encode(self, messages, normalize_embeddings):
+        vecs = np.zeros((len(messages), DIM), dtype="float32")
+        for row, message in enumerate(messages):
+            axis = int(message.strip("e~"))
+            vecs[row, axis] = 1
+            if message.endswith("~"):
+                vecs[row, (axis + 1) % DIM] = 0.3
+        return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def semantic_cache(monkeypatch):
+    stub = types.ModuleType("sentence_transformers")
+    stub.SentenceTransformer = StubEmbedder
+    monkeypatch.setitem(sys.modules, "sentence_transformers", stub)
+    monkeypatch.delitem(sys.modules, "semantic_cache", raising=False)
+    return importlib.import_module("semantic_cache")
+
+
+BUCKET = ("u1", '"v1"', "casual", ("funny",))
+
+
+def _fill(cache, *messages):
+    for message in messages:
+        cache.add(BUCKET, cache.embed(message), {"funny": [message]})
+
+
+def test_paraphrase_above_threshold_hits(semantic_cache):
+    cache = semantic_cache.SemanticCache(threshold=0.92)
+    _fill(cache, "e0", "e1")
+
+    assert cache.lookup(BUCKET, cache.embed("e0~")) == {"funny": ["e0"]} # cosine ~0.96
+
+
+def test_below_threshold_misses(semantic_cache):
+    cache = semantic_cache.SemanticCache(threshold=0.99)
+    _fill(cache, "e0")
+
+    assert cache.lookup(BUCKET, cache.embed("e0~")) is None
+    assert cache.lookup(BUCKET, cache.embed("e1")) is None
+
+
+def test_buckets_are_separate(semantic_cache):
+    cache = semantic_cache.SemanticCache()
+    _fill(cache, "e0")
+
+    assert cache.lookup(("u1", '"v2"', "casual", ("funny",)), cache.embed("e0")) is None
+
+
+def test_full_bucket_keeps_its_newest_half(semantic_cache):
+    cache = semantic_cache.SemanticCache(max_entries_per_bucket=4)
+    _fill(cache, "e0", "e1", "e2", "e3", "e4")
+
+    assert cache._buckets[BUCKET].index.ntotal == 3
+    assert [cache.lookup(BUCKET, cache.embed(m)) for m in ("e0", "e1")] == [None, None]
+    for message in ("e2", "e3", "e4"):
+        assert cache.lookup(BUCKET, cache.embed(message)) == {"funny": [message]}
+
+
+def test_only_idle_buckets_expire(semantic_cache):
+    now = [0.0]
+    cache = semantic_cache.SemanticCache()
+    cache._buckets = TTLCache(maxsize=10, ttl=10, timer=lambda: now[0])
+    _fill(cache, "e0")
+
+    now[0] = 8
+    assert cache.lookup(BUCKET, cache.embed("e0")) is not None # renews the bucket
+    now[0] = 16
+    assert cache.lookup(BUCKET, cache.embed("e0")) is not None
+    now[0] = 27
+    assert cache.lookup(BUCKET, cache.embed("e0")) is None
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+from cachetools import TTLCache
+from fastapi import HTTPException
+
+import main
+
+OPTIONS = {"funny": ["ha"], "direct": ["ok"]}
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    monkeypatch.setattr(main, "_response_cache", TTLCache(maxsize=100, ttl=60))
+    yield
+    assert main._inflight == {}
+
+
+@pytest.fixture
+def generation(monkeypatch):
+    """Replaces the LLM call; it blocks until `gate` is set and then returns `result`, or raises it."""
+    state = {"calls": 0, "gate": None, "result": OPTIONS}
+
+    async def generate_options(formatted_user_profile, request):
+        state["calls"] += 1
+        await state["gate"].wait()
+        if isinstance(state["result"], Exception):
+            raise state["result"]
+        return state["result"]
+
+    monkeypatch.setattr(main, "_generate_options", generate_options)
+    return state
+
+
+@pytest.fixture
+def stream_reply(monkeypatch):
+    """Replaces the streaming chain; the reply pauses at `gate` after its first tone."""
+    state = {"gate": None}
+
+    class Chain:
+        async def astream(self, inputs):
+            yield '{"options": {"funny": ["ha"]'
+            await state["gate"].wait()
+            yield ', "direct": ["ok"]}}'
+
+    monkeypatch.setattr(main, "_chain_for_user", lambda user_id, prompt=main._PROMPT, parser=main._OUTPUT_PARSER: Chain())
+    return state
+
+
+@pytest.fixture(autouse=True)
+def profile_lookup(monkeypatch, stored):
+    async def get(user_id):
+        return stored
+    monkeypatch.setattr(main.profile_store, "get", get)
+
+
+def test_concurrent_requests_share_one_generation(generation, generate_request, settle):
+    async def scenario():
+        generation["gate"] = asyncio.Event()
+        calls = [asyncio.create_task(main.generate_responses_sync_endpoint(generate_request)) for _ in range(3)]
+        await settle()
+        generation["gate"].set()
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(scenario())
+
+    assert results == [{"options": OPTIONS}] * 3
+    assert generation["calls"] == 1
+    assert list(main._response_cache.values()) == [OPTIONS]
+
+
+def test_generation_outlives_a_disconnected_leader(generation, generate_request, settle):
+    async def scenario():
+        generation["gate"] = asyncio.Event()
+        leader = asyncio.create_task(main.generate_responses_sync_endpoint(generate_request))
+        await settle()
+        leader.cancel()
+        waiter = asyncio.create_task(main.generate_responses_sync_endpoint(generate_request))
+        await settle()
+        generation["gate"].set()
+        return await waiter
+
+    assert asyncio.run(scenario()) == {"options": OPTIONS}
+    assert generation["calls"] == 1
+
+
+def test_errors_reach_every_waiter(generation, generate_request, settle):
+    generation["result"] = RuntimeError("provider down")
+
+    async def scenario():
+        generation["gate"] = asyncio.Event()
+        calls = [asyncio.create_task(main.generate_responses_sync_endpoint(generate_request)) for _ in range(2)]
+        await settle()
+        generation["gate"].set()
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+
+    assert all(isinstance(r, HTTPException) and "provider down" in r.detail for r in results)
+    assert generation["calls"] == 1
+    assert len(main._response_cache) == 0
+
+
+def test_stream_waiter_reports_any_error(stored, generate_request, settle):
+    async def scenario():
+        cache_key = main._response_cache_key(stored.prompt_json, generate_request)
+        flight = main._begin_flight(cache_key)
+        stream = main._stream_options(stored, generate_request)
+        first = asyncio.create_task(stream.__anext__())
+        await settle()
+        flight.set_exception(RuntimeError("embedding failed"))
+        main._end_flight(cache_key, flight)
+        return await first
+
+    event = asyncio.run(scenario())
+
+    assert event.startswith("event: error\n")
+    assert "embedding failed" in event
+
+
+def test_abandoned_stream_lets_waiters_generate(generation, stream_reply, stored, generate_request, settle):
+    async def scenario():
+        generation["gate"] = asyncio.Event()
+        stream_reply["gate"] = asyncio.Event()
+        stream = main._stream_options(stored, generate_request)
+        assert '"funny"' in await stream.__anext__()
+
+        waiter = asyncio.create_task(main.generate_responses_sync_endpoint(generate_request))
+        await settle()
+        assert generation["calls"] == 0 # waiting on the stream
+        await stream.aclose() # the streaming client disconnects
+        await settle()
+        generation["gate"].set()
+        return await waiter
+
+    assert asyncio.run(scenario()) == {"options": OPTIONS}
+    assert generation["calls"] == 1
+
+
+def test_stream_is_cached_before_the_done_event(stream_reply, stored, generate_request):
+    async def scenario():
+        stream_reply["gate"] = asyncio.Event()
+        stream_reply["gate"].set()
+        stream = main._stream_options(stored, generate_request)
+        events = []
+        async for event in stream:
+            events.append(event)
+            if event == main._SSE_DONE:
+                # What a client that disconnects right after the done event leaves behind
+                cached = dict(main._response_cache)
+                await stream.aclose()
+                break
+        return events, cached
+
+    events, cached = asyncio.run(scenario())
+
+    assert len(events) == 3
+    assert list(cached.values()) == [OPTIONS]
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from cachetools import TTLCache
+
+import main
+
+
+class StreamChain:
+    def __init__(self, *chunks):
+        self.chunks = chunks
+
+    async def astream(self, inputs):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class RepairChain:
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    async def ainvoke(self, inputs):
+        self.calls.append(inputs)
+        return self.result
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(main, "_response_cache", TTLCache(maxsize=100, ttl=60))
+
+
+def _use_chains(monkeypatch, stream, repair=None):
+    def chain_for_user(user_id, prompt=main._PROMPT, parser=main._OUTPUT_PARSER):
+        return repair if prompt is main._REPAIR_PROMPT else stream
+    monkeypatch.setattr(main, "_chain_for_user", chain_for_user)
+
+
+@pytest.fixture
+def stream_events(stored, generate_request):
+    """Runs the stream for the shared test request and returns all of its events."""
+    def run():
+        async def collect():
+            return [event async for event in main._stream_options(stored, generate_request)]
+        return asyncio.run(collect())
+    return run
+
+
+def test_streams_one_event_per_tone(monkeypatch, stream_events):
+    _use_chains(monkeypatch, StreamChain('```json\n{"options": {"funny": ["ha"]', ', "direct": ["ok"]}}\n```'))
+
+    assert stream_events() == [
+        main._sse_event({"tone": "funny", "options": ["ha"]}),
+        main._sse_event({"tone": "direct", "options": ["ok"]}),
+        main._SSE_DONE,
+    ]
+
+
+def test_tone_line_reply_falls_back_to_the_line_parser(monkeypatch, stream_events):
+    repair = RepairChain({"options": {}})
+    _use_chains(monkeypatch, StreamChain("Funny: ha | ho\n", "Direct: ok\n"), repair)
+
+    assert stream_events() == [
+        main._sse_event({"tone": "funny", "options": ["ha", "ho"]}),
+        main._sse_event({"tone": "direct", "options": ["ok"]}),
+        main._SSE_DONE,
+    ]
+    assert repair.calls == []
+
+
+def test_partial_tone_line_reply_is_repaired(monkeypatch, stream_events):
+    repair = RepairChain({"options": {"funny": ["ha"], "direct": ["ok"]}})
+    _use_chains(monkeypatch, StreamChain("Funny: ha\nNote: direct is missing\n"), repair)
+
+    assert stream_events() == [
+        main._sse_event({"tone": "funny", "options": ["ha"]}),
+        main._sse_event({"tone": "direct", "options": ["ok"]}),
+        main._SSE_DONE,
+    ]
+    assert len(repair.calls) == 1
+
+
+def test_unparseable_reply_is_repaired(monkeypatch, stream_events):
+    repair = RepairChain({"options": {"funny": ["ha"]}})
+    _use_chains(monkeypatch, StreamChain("Sure! Here ", "you go."), repair)
+
+    assert stream_events() == [main._sse_event({"tone": "funny", "options": ["ha"]}), main._SSE_DONE]
+    assert repair.calls[0]["bad_output"] == "Sure! Here you go."
+
+
+def test_failed_repair_ends_with_an_error_event(monkeypatch, stream_events):
+    _use_chains(monkeypatch, StreamChain("nothing useful"), RepairChain({"options": {}}))
+
+    events = stream_events()
+
+    assert len(events) == 1
+    assert events[0].startswith("event: error\n")
+    assert len(main._response_cache) == 0
@@ -0,0 +1,19 @@
+from main import _parse_tone_lines
+
+
+def test_keys_are_normalized_like_the_json_path():
+    reply = "Semi_formal: a | b\nFunny: c"
+    assert _parse_tone_lines(reply, ["funny", "semi_formal"]) == {"semi_formal": ["a", "b"], "funny": ["c"]}
+
+
+def test_spaces_and_hyphens_become_underscores():
+    assert _parse_tone_lines("SEMI FORMAL: a\nGroup-chat: b", ["semi_formal"]) == {"semi_formal": ["a"]}
+
+
+def test_only_requested_tones_are_kept():
+    reply = "Note: here are your options\nFunny: ha\nDirect: ok"
+    assert _parse_tone_lines(reply, ["funny"]) == {"funny": ["ha"]}
+
+
+def test_empty_options_are_dropped():
+    assert _parse_tone_lines("Funny: | \nDirect: ok", ["direct", "funny"]) == {"direct": ["ok"]}
@@ -0,0 +1,65 @@
+import pytest
+
+from tone_stream import ToneStreamParser
+
+REPLY = '{"options": {"funny": ["Only if you bring \\"coffee\\"."], "direct": ["Yes.", "Tuesday works."]}}'
+TONES = [("funny", ['Only if you bring "coffee".']), ("direct", ["Yes.", "Tuesday works."])]
+
+
+def _parse(*chunks):
+    parser = ToneStreamParser()
+    return [pair for chunk in chunks for pair in parser.feed(chunk)]
+
+
+def test_whole_reply():
+    assert _parse(REPLY) == TONES
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_any_chunk_split(size):
+    assert _parse(*(REPLY[i:i + size] for i in range(0, len(REPLY), size))) == TONES
+
+
+def test_tone_is_yielded_as_soon_as_its_array_closes():
+    parser = ToneStreamParser()
+    assert list(parser.feed('{"options": {"funny": ["ha"')) == []
+    assert list(parser.feed(']')) == [("funny", ["ha"])]
+
+
+def test_brackets_and_escapes_inside_strings():
+    reply = r'{"options": {"funny": ["a ] b", "c } d", "back\\slash", "\"]\""]}}'
+    assert _parse(reply) == [("funny", ["a ] b", "c } d", "back\\slash", '"]"'])]
+
+
+def test_markdown_fence():
+    assert _parse("```json\n", REPLY, "\n```") == TONES
+
+
+def test_other_root_keys_before_options():
+    assert _parse('{"note": [1, 2], "options": {"funny": ["ha"]}}') == [("funny", ["ha"])]
+
+
+def test_other_root_keys_after_options():
+    assert _parse('{"options": {"funny": ["ha"]}, "meta": {"lang": ["en"]}}') == [("funny", ["ha"])]
+
+
+def test_string_values_are_single_options():
+    assert _parse('{"options": {"a": "x", "b": ["y"]}}') == [("a", ["x"]), ("b", ["y"])]
+
+
+def test_non_string_options_are_dropped():
+    assert _parse('{"options": {"a": [1, "x", null, " "], "b": 3, "c": {"d": ["e"]}}}') == [("a", ["x"])]
+
+
+def test_malformed_entry_is_skipped():
+    assert _parse('{"options": {"a": [x], "b": ["y"]}}') == [("b", ["y"])]
+
+
+@pytest.mark.parametrize("reply", [
+    "Funny: ha | ho",
+    '{"funny": ["ha"]}',
+    '{"options": ["ha"]}',
+    "}]]}",
+])
+def test_replies_without_options(reply):
+    assert _parse(reply) == []
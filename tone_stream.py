@@ -0,0 +1,99 @@
+from typing import Iterator, List, Optional, Tuple
+
+import orjson
+
+class ToneStreamParser:
+    """
+    Incrementally scans a streamed `{"options": {"<tone>": [...], ...}}` reply and yields each
+    (tone, options) pair as soon as its value is complete. Only the entry currently being streamed is
+    buffered, never the whole reply.
+
+    Only entries directly under the root's "options" object are parsed; other keys, text around the
+    JSON (such as Markdown fences) and entries that aren't valid JSON are skipped.
+    """
+
+    def __init__(self):
+        self._depth = 0 # 1 inside the root object, 2 inside one of its values, 3+ deeper
+        self._in_string = False
+        self._escaped = False
+        self._expect_key = False # at depth 1, whether the next string is a key rather than a value
+        self._key: Optional[List[str]] = None # characters of the root key being read
+        self._root_key = "" # the root key whose value is being read
+        self._in_options = False # inside the root's "options" object
+        self._entry: List[str] = [] # characters of the `"<tone>": [...]` entry in progress
+
+    def feed(self, chunk: str) -> Iterator[Tuple[str, List[str]]]:
+        for ch in chunk:
+            if self._in_string:
+                if self._in_options:
+                    self._entry.append(ch)
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key is not None:
+                        self._root_key = "".join(self._key)
+                        self._key = None
+                    continue
+                if self._key is not None:
+                    self._key.append(ch)
+            elif ch == '"':
+                if self._depth == 0:
+                    continue
+                self._in_string = True
+                if self._in_options:
+                    self._entry.append(ch)
+                elif self._depth == 1 and self._expect_key:
+                    self._key = []
+            elif ch in "{[":
+                if self._depth == 0:
+                    if ch == "{":
+                        self._depth = 1
+                        self._expect_key = True
+                    continue
+                if self._depth == 1:
+                    self._in_options = ch == "{" and self._root_key == "options"
+                elif self._in_options:
+                    self._entry.append(ch)
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    continue
+                self._depth -= 1
+                if self._in_options:
+                    if self._depth >= 2:
+                        self._entry.append(ch)
+                    if self._depth <= 2:
+                        yield from self._flush_entry()
+                    if self._depth == 1:
+                        self._in_options = False
+            elif self._depth == 1:
+                if ch == ":":
+                    self._expect_key = False
+                elif ch == ",":
+                    self._expect_key = True
+            elif self._in_options:
+                if self._depth == 2 and ch == ",":
+                    yield from self._flush_entry()
+                else:
+                    self._entry.append(ch)
+
+    def _flush_entry(self) -> Iterator[Tuple[str, List[str]]]:
+        text = "".join(self._entry).strip()
+        self._entry.clear()
+        if not text:
+            return
+        try:
+            entry = orjson.loads("{" + text + "}")
+        except orjson.JSONDecodeError:
+            return
+        for tone, options in entry.items():
+            if isinstance(options, str):
+                options = [options]
+            elif not isinstance(options, list):
+                continue
+            options = [opt.strip() for opt in options if isinstance(opt, str) and opt.strip()]
+            if options:
+                yield tone, options